@@ -1,18 +1,22 @@
 import os
 import re
+import io
+import csv
 import json
 import random
 import asyncio
+import uuid
 import logging
 import httpx
 import psycopg2
 from datetime import datetime
-from threading import Thread
+from threading import Thread, Lock
 
 from aiohttp import web
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.types import Message
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import Command
 from aiogram.client.default import DefaultBotProperties
 
@@ -110,6 +114,248 @@ async def handle_admin_clear(request):
     except Exception:
         return web.json_response({"ok": False, "error": "bad_request"})
 
+# ─────────────────────────────────────────────
+#  Рассылка: пул отправки с учётом лимитов Telegram
+# ─────────────────────────────────────────────
+BROADCAST_CONCURRENCY = 5      # одновременных отправок
+BROADCAST_RATE = 25            # сообщений/сек на все рассылки (лимит Telegram ~30, оставляем запас боту)
+CHAT_MIN_INTERVAL = 1.0        # личка: не чаще 1 сообщения в секунду
+GROUP_MIN_INTERVAL = 3.0       # группа: не чаще 20 сообщений в минуту
+BROADCAST_MAX_RETRIES = 3
+MAX_BROADCAST_JOBS = 20
+
+broadcast_jobs = {}    # job_id -> статус и результаты рассылки
+broadcast_jobs_lock = Lock()  # задачи пишут из цикла бота, HTTP-поток читает
+broadcast_tasks = set()  # ссылки на фоновые задачи, чтобы их не собрал GC
+chat_last_sent = {}    # chat_id -> время (loop.time()) последней отправки
+
+class RateLimiter:
+    """Глобальный лимит отправок в секунду; pause() — заморозка после RetryAfter."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            while (delay := self.next_slot - loop.time()) > 0:
+                await asyncio.sleep(delay)
+            self.next_slot = loop.time() + self.interval
+
+    def pause(self, seconds):
+        resume_at = asyncio.get_running_loop().time() + seconds
+        self.next_slot = max(self.next_slot, resume_at)
+
+broadcast_limiter = RateLimiter(BROADCAST_RATE)
+broadcast_semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)  # общий на все рассылки
+
+async def wait_chat_slot(chat_id):
+    """Выдерживает паузу между сообщениями в один и тот же чат."""
+    loop = asyncio.get_running_loop()
+    interval = GROUP_MIN_INTERVAL if chat_id < 0 else CHAT_MIN_INTERVAL
+    now = loop.time()
+    slot = max(now, chat_last_sent.get(chat_id, now - interval) + interval)
+    chat_last_sent[chat_id] = slot  # бронируем слот до сна, чтобы параллельные рассылки не совпали
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
+async def broadcast_send_one(chat_id, text):
+    """Отправить одно сообщение рассылки. Возвращает "ok" или код ошибки.
+    Слот broadcast_semaphore занимается только на саму отправку, не на ожидание."""
+    for attempt in range(BROADCAST_MAX_RETRIES):
+        await wait_chat_slot(chat_id)
+        try:
+            async with broadcast_semaphore:
+                await broadcast_limiter.wait()
+                await bot.send_message(chat_id, text, parse_mode=ParseMode.HTML)
+            return "ok"
+        except TelegramRetryAfter as e:
+            logger.warning(f"Рассылка: flood control, ждём {e.retry_after} с (чат {chat_id})")
+            broadcast_limiter.pause(e.retry_after)
+            if attempt == BROADCAST_MAX_RETRIES - 1:
+                break
+            await asyncio.sleep(e.retry_after)
+    return "retry_after"
+
+async def run_broadcast(job_id, chat_ids, text):
+    """Фоновая рассылка в цикле бота; одновременных отправок по всем рассылкам
+    не больше BROADCAST_CONCURRENCY."""
+    job = broadcast_jobs[job_id]
+    with broadcast_jobs_lock:
+        job["status"] = "running"
+    queue = asyncio.Queue()
+    for chat_id in chat_ids:
+        queue.put_nowait(chat_id)
+
+    async def worker():
+        while not queue.empty():
+            chat_id = queue.get_nowait()
+            try:
+                result = await broadcast_send_one(chat_id, text)
+            except Exception as e:
+                result = f"{type(e).__name__}: {e}"
+            with broadcast_jobs_lock:
+                job["results"][str(chat_id)] = result
+                if result == "ok":
+                    job["sent"] += 1
+                else:
+                    job["failed"] += 1
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(BROADCAST_CONCURRENCY, len(chat_ids)))))
+        status = "done"
+    except Exception as e:
+        logger.error(f"Рассылка {job_id}: {type(e).__name__}: {e}")
+        status = "error"
+    with broadcast_jobs_lock:
+        job["status"] = status
+        job["finished"] = datetime.now().strftime("%H:%M:%S")
+    add_admin_message("admin", 0, "Рассылка", f"{text} (✅ {job['sent']} / ❌ {job['failed']})")
+
+def prune_broadcast_jobs():
+    """Освобождает место под новую рассылку, выкидывая самые старые завершённые.
+    Возвращает False, если все MAX_BROADCAST_JOBS записей ещё в работе."""
+    finished = [jid for jid, job in broadcast_jobs.items() if job["status"] in ("done", "error")]
+    while len(broadcast_jobs) >= MAX_BROADCAST_JOBS and finished:
+        broadcast_jobs.pop(finished.pop(0))
+    return len(broadcast_jobs) < MAX_BROADCAST_JOBS
+
+async def handle_admin_broadcast(request):
+    """POST /api/broadcast — рассылка по списку chat_ids или по всем известным чатам (all: true)."""
+    try:
+        data = await request.json()
+        pwd = data.get("password", "")
+        if pwd != ADMIN_PASSWORD:
+            return web.json_response({"ok": False, "error": "unauthorized"}, status=401)
+
+        if BOT_LOOP is None:
+            return web.json_response({"ok": False, "error": "bot_not_ready"})
+
+        text = data.get("text", "").strip()
+        if data.get("all"):
+            chat_ids = await asyncio.to_thread(get_all_known_chats)
+        else:
+            raw_ids = data.get("chat_ids", [])
+            if not isinstance(raw_ids, list):
+                return web.json_response({"ok": False, "error": "bad_request"})
+            chat_ids = [int(cid) for cid in raw_ids]
+        chat_ids = list(dict.fromkeys(cid for cid in chat_ids if cid))
+        if not chat_ids or not text:
+            return web.json_response({"ok": False, "error": "missing_fields"})
+
+        job_id = uuid.uuid4().hex[:12]
+        with broadcast_jobs_lock:
+            if not prune_broadcast_jobs():
+                return web.json_response({"ok": False, "error": "too_many_jobs"}, status=429)
+            broadcast_jobs[job_id] = {
+                "status": "queued",
+                "total": len(chat_ids),
+                "sent": 0,
+                "failed": 0,
+                "results": {},
+                "created": datetime.now().strftime("%H:%M:%S"),
+                "finished": None,
+            }
+        # Сессия бота живёт в цикле поллинга — отправляем оттуда, а не из цикла HTTP-сервера
+        future = asyncio.run_coroutine_threadsafe(run_broadcast(job_id, chat_ids, text), BOT_LOOP)
+        broadcast_tasks.add(future)
+        future.add_done_callback(broadcast_tasks.discard)
+        return web.json_response({"ok": True, "job_id": job_id, "total": len(chat_ids)})
+    except Exception as e:
+        return web.json_response({"ok": False, "error": str(e)})
+
+async def handle_admin_broadcast_status(request):
+    """GET /api/broadcast?password=xxx[&job_id=...] — прогресс рассылки или список рассылок."""
+    pwd = request.query.get("password", "")
+    if pwd != ADMIN_PASSWORD:
+        return web.json_response({"ok": False, "error": "unauthorized"}, status=401)
+    job_id = request.query.get("job_id")
+    with broadcast_jobs_lock:
+        if job_id:
+            job = broadcast_jobs.get(job_id)
+            if job is not None:
+                job = dict(job, results=dict(job["results"]))
+        else:
+            jobs = [{"job_id": jid, **{k: v for k, v in job.items() if k != "results"}}
+                    for jid, job in broadcast_jobs.items()]
+    if job_id:
+        if job is None:
+            return web.json_response({"ok": False, "error": "not_found"}, status=404)
+        return web.json_response({"ok": True, "job_id": job_id, **job})
+    return web.json_response({"ok": True, "jobs": jobs})
+
+# ─────────────────────────────────────────────
+#  Экспорт аналитики (только сводные таблицы)
+# ─────────────────────────────────────────────
+STATS_EXPORT_TABLES = {
+    "chat": ("stats_chat_hourly", ["hour", "chat_id", "messages", "llm_calls"]),
+    "triggers": ("stats_triggers_hourly", ["hour", "chat_id", "trigger", "count"]),
+    "reputation": ("stats_reputation_hourly", ["hour", "chat_id", "user_id", "delta", "votes"]),
+}
+STATS_EXPORT_BATCH = 500
+
+def open_stats_export(table_name, columns, since):
+    """Открыть серверный курсор по сводной таблице: строки приходят пачками,
+    а не всей таблицей в память."""
+    conn = get_db()
+    try:
+        c = conn.cursor(name="stats_export")
+        c.itersize = STATS_EXPORT_BATCH
+        c.execute(f"SELECT {', '.join(columns)} FROM {table_name} WHERE hour >= %s ORDER BY hour, chat_id",
+                  (since,))
+    except Exception:
+        conn.close()
+        raise
+    return conn, c
+
+async def handle_admin_export(request):
+    """GET /api/export?password=xxx&table=chat|triggers|reputation&format=csv|jsonl[&since=YYYY-MM-DD HH:00]"""
+    pwd = request.query.get("password", "")
+    if pwd != ADMIN_PASSWORD:
+        return web.json_response({"ok": False, "error": "unauthorized"}, status=401)
+    table = request.query.get("table", "chat")
+    fmt = request.query.get("format", "csv")
+    since = request.query.get("since", "")
+    if table not in STATS_EXPORT_TABLES or fmt not in ("csv", "jsonl"):
+        return web.json_response({"ok": False, "error": "bad_request"}, status=400)
+    table_name, columns = STATS_EXPORT_TABLES[table]
+
+    # Запрос — до prepare(): пока заголовки не отправлены, ошибку БД можно вернуть JSON-ом.
+    # Вся работа с БД — в потоках, чтобы не стопорить цикл админ-API.
+    try:
+        conn, c = await asyncio.to_thread(open_stats_export, table_name, columns, since)
+    except Exception as e:
+        logger.error(f"Экспорт {table_name}: {type(e).__name__}: {e}")
+        return web.json_response({"ok": False, "error": "db_error"}, status=500)
+
+    try:
+        resp = web.StreamResponse(headers={
+            "Content-Type": "text/csv; charset=utf-8" if fmt == "csv" else "application/x-ndjson",
+            "Content-Disposition": f'attachment; filename="{table_name}.{fmt}"',
+        })
+        await resp.prepare(request)
+        if fmt == "csv":
+            buf = io.StringIO()
+            csv.writer(buf).writerow(columns)
+            await resp.write(buf.getvalue().encode())
+        while True:
+            rows = await asyncio.to_thread(c.fetchmany, STATS_EXPORT_BATCH)
+            if not rows:
+                break
+            buf = io.StringIO()
+            if fmt == "csv":
+                csv.writer(buf).writerows(rows)
+            else:
+                for row in rows:
+                    buf.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+            await resp.write(buf.getvalue().encode())
+    finally:
+        await asyncio.to_thread(conn.close)
+    await resp.write_eof()
+    return resp
+
 def run_keepalive():
     """HTTP-сервер: keep-alive + API для админ-панели."""
     app = web.Application()
@@ -121,20 +367,25 @@ def run_keepalive():
     app.router.add_get("/api/messages", handle_admin_messages)
     app.router.add_post("/api/send", handle_admin_send)
     app.router.add_post("/api/clear", handle_admin_clear)
+    app.router.add_post("/api/broadcast", handle_admin_broadcast)
+    app.router.add_get("/api/broadcast", handle_admin_broadcast_status)
+    app.router.add_get("/api/export", handle_admin_export)
 
-    # CORS middleware
+    # CORS: заголовки ставим в on_response_prepare, чтобы они попадали
+    # и в потоковые ответы (/api/export), где заголовки уходят до return
     @web.middleware
     async def cors_middleware(request, handler):
         if request.method == "OPTIONS":
-            resp = web.Response()
-        else:
-            resp = await handler(request)
+            return web.Response()
+        return await handler(request)
+
+    async def add_cors_headers(request, resp):
         resp.headers["Access-Control-Allow-Origin"] = "*"
         resp.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
         resp.headers["Access-Control-Allow-Headers"] = "Content-Type"
-        return resp
 
     app.middlewares.append(cors_middleware)
+    app.on_response_prepare.append(add_cors_headers)
 
     runner = web.AppRunner(app)
     loop = asyncio.new_event_loop()
@@ -153,6 +404,7 @@ router = Router()
 dp = Dispatcher()
 dp.include_router(router)
 BOT_INFO = None
+BOT_LOOP = None  # цикл поллинга, которому принадлежит сессия бота
 
 # ─────────────────────────────────────────────
 #  Qurox API через httpx
@@ -200,6 +452,22 @@ def init_db():
         created_at TEXT DEFAULT ''
     )""")
     c.execute("CREATE INDEX IF NOT EXISTS idx_memory_chat ON chat_memory(chat_id, id)")
+    # Почасовые сводки для аналитики (сырые таблицы для дашбордов не сканируем)
+    c.execute("""CREATE TABLE IF NOT EXISTS stats_chat_hourly (
+        hour TEXT NOT NULL, chat_id BIGINT NOT NULL,
+        messages INTEGER DEFAULT 0, llm_calls INTEGER DEFAULT 0,
+        PRIMARY KEY (hour, chat_id)
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS stats_triggers_hourly (
+        hour TEXT NOT NULL, chat_id BIGINT NOT NULL, trigger TEXT NOT NULL,
+        count INTEGER DEFAULT 0,
+        PRIMARY KEY (hour, chat_id, trigger)
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS stats_reputation_hourly (
+        hour TEXT NOT NULL, chat_id BIGINT NOT NULL, user_id BIGINT NOT NULL,
+        delta INTEGER DEFAULT 0, votes INTEGER DEFAULT 0,
+        PRIMARY KEY (hour, chat_id, user_id)
+    )""")
     conn.commit()
     conn.close()
     logger.info("PostgreSQL — таблицы готовы")
@@ -256,6 +524,15 @@ def get_all_known_users():
     conn.close()
     return list(set(row[0] for row in rows if row[0]))
 
+def get_all_known_chats():
+    """Все чаты, в которых бот видел сообщения."""
+    conn = get_db()
+    c = conn.cursor()
+    c.execute("SELECT chat_id FROM chat_counters UNION SELECT chat_id FROM chat_memory")
+    rows = c.fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
 def check_bot_kto(text):
     """
     Проверяет паттерн «бот кто [слово]» или «нейро кто [слово]».
@@ -389,6 +666,87 @@ def reset_chat_counter(chat_id):
     conn.commit()
     conn.close()
 
+# ─────────────────────────────────────────────
+#  Аналитика: почасовые сводки
+# ─────────────────────────────────────────────
+# Обработчики только увеличивают счётчики в памяти, фоновая задача раз в
+# STATS_FLUSH_INTERVAL секунд досчитывает их в stats_* таблицы через UPSERT.
+STATS_FLUSH_INTERVAL = 60
+
+stats_chat = {}        # (hour, chat_id) -> [messages, llm_calls]
+stats_triggers = {}    # (hour, chat_id, trigger) -> count
+stats_reputation = {}  # (hour, chat_id, user_id) -> [delta, votes]
+
+def stats_hour():
+    return datetime.now().strftime("%Y-%m-%d %H:00")
+
+def record_message(chat_id):
+    row = stats_chat.setdefault((stats_hour(), chat_id), [0, 0])
+    row[0] += 1
+
+def record_llm_call(chat_id):
+    row = stats_chat.setdefault((stats_hour(), chat_id), [0, 0])
+    row[1] += 1
+
+def record_trigger(chat_id, trigger):
+    key = (stats_hour(), chat_id, trigger)
+    stats_triggers[key] = stats_triggers.get(key, 0) + 1
+
+def record_reputation(chat_id, user_id, delta):
+    row = stats_reputation.setdefault((stats_hour(), chat_id, user_id), [0, 0])
+    row[0] += delta
+    row[1] += 1
+
+def write_stats(chat_rows, trigger_rows, reputation_rows):
+    """Досчитать накопленные счётчики в сводные таблицы."""
+    conn = get_db()
+    c = conn.cursor()
+    c.executemany("INSERT INTO stats_chat_hourly (hour, chat_id, messages, llm_calls) VALUES (%s, %s, %s, %s) "
+                  "ON CONFLICT (hour, chat_id) DO UPDATE SET "
+                  "messages = stats_chat_hourly.messages + EXCLUDED.messages, "
+                  "llm_calls = stats_chat_hourly.llm_calls + EXCLUDED.llm_calls",
+                  [(h, cid, m, l) for (h, cid), (m, l) in chat_rows.items()])
+    c.executemany("INSERT INTO stats_triggers_hourly (hour, chat_id, trigger, count) VALUES (%s, %s, %s, %s) "
+                  "ON CONFLICT (hour, chat_id, trigger) DO UPDATE SET "
+                  "count = stats_triggers_hourly.count + EXCLUDED.count",
+                  [(h, cid, t, n) for (h, cid, t), n in trigger_rows.items()])
+    c.executemany("INSERT INTO stats_reputation_hourly (hour, chat_id, user_id, delta, votes) "
+                  "VALUES (%s, %s, %s, %s, %s) "
+                  "ON CONFLICT (hour, chat_id, user_id) DO UPDATE SET "
+                  "delta = stats_reputation_hourly.delta + EXCLUDED.delta, "
+                  "votes = stats_reputation_hourly.votes + EXCLUDED.votes",
+                  [(h, cid, uid, d, v) for (h, cid, uid), (d, v) in reputation_rows.items()])
+    conn.commit()
+    conn.close()
+
+async def flush_stats():
+    """Забрать накопленные счётчики и записать их в БД, не блокируя цикл бота."""
+    global stats_chat, stats_triggers, stats_reputation
+    chat_rows, trigger_rows, reputation_rows = stats_chat, stats_triggers, stats_reputation
+    if not (chat_rows or trigger_rows or reputation_rows):
+        return
+    stats_chat, stats_triggers, stats_reputation = {}, {}, {}
+    try:
+        await asyncio.to_thread(write_stats, chat_rows, trigger_rows, reputation_rows)
+    except Exception as e:
+        logger.error(f"Аналитика: {type(e).__name__}: {e}")
+        # Возвращаем несохранённое обратно, чтобы досчитать при следующем сбросе
+        for key, (m, l) in chat_rows.items():
+            row = stats_chat.setdefault(key, [0, 0])
+            row[0] += m
+            row[1] += l
+        for key, n in trigger_rows.items():
+            stats_triggers[key] = stats_triggers.get(key, 0) + n
+        for key, (d, v) in reputation_rows.items():
+            row = stats_reputation.setdefault(key, [0, 0])
+            row[0] += d
+            row[1] += v
+
+async def stats_flush_loop():
+    while True:
+        await asyncio.sleep(STATS_FLUSH_INTERVAL)
+        await flush_stats()
+
 # ─────────────────────────────────────────────
 #  Системный промпт
 # ─────────────────────────────────────────────
@@ -412,6 +770,7 @@ async def ask_neurodeep(chat_id, user_message, user_name="Аноним"):
         save_memory(chat_id, "user", f"[{user_name}]: {user_message}")
         messages = [{"role": "system", "content": SYSTEM_PROMPT}]
         messages.extend(get_memory(chat_id))
+        record_llm_call(chat_id)
         answer = await qurox_chat(messages, max_tokens=300, temperature=0.9)
         save_memory(chat_id, "assistant", answer)
         add_admin_message("bot", chat_id, "NeuroDeep", answer)
@@ -512,6 +871,7 @@ async def cmd_rep_plus(message: Message):
         return await message.answer("Сам себе? Не, так не работает 😏")
     get_or_create_user(target.id, target.username or "", target.full_name or "")
     update_reputation(target.id, +1)
+    record_reputation(message.chat.id, target.id, +1)
     await message.answer(f"⬆️ {target.full_name} +1 репа! 🔥")
 
 @router.message(F.text.startswith("!реп-"))
@@ -523,6 +883,7 @@ async def cmd_rep_minus(message: Message):
         return await message.answer("Самокритика? 😂")
     get_or_create_user(target.id, target.username or "", target.full_name or "")
     update_reputation(target.id, -1)
+    record_reputation(message.chat.id, target.id, -1)
     await message.answer(f"⬇️ {target.full_name} -1 репа 💀")
 
 @router.message(F.text.startswith("!топ"))
@@ -564,10 +925,12 @@ async def cmd_neuro(message: Message):
         if need_pair and len(members) >= 2:
             chosen = random.sample(members, 2)
             template = random.choice(BOT_KTO_TEMPLATES_2)
+            record_trigger(message.chat.id, "kto")
             return await message.answer(template.format(name1=chosen[0], name2=chosen[1], word=word))
         elif len(members) >= 1:
             chosen = random.choice(members)
             template = random.choice(BOT_KTO_TEMPLATES_1)
+            record_trigger(message.chat.id, "kto")
             return await message.answer(template.format(word=word, name=chosen))
         else:
             return await message.answer("😅 Мало людей! Пусть кто-то напишет сначала.")
@@ -577,6 +940,8 @@ async def cmd_neuro(message: Message):
     get_or_create_user(message.from_user.id, message.from_user.username or "",
                        message.from_user.full_name or "")
     increment_user_messages(message.from_user.id)
+    record_message(message.chat.id)
+    record_trigger(message.chat.id, "neuro")
     add_admin_message("user", message.chat.id, user_name, question)
     response = await ask_neurodeep(message.chat.id, question, user_name)
     await message.reply(response)
@@ -615,6 +980,7 @@ async def on_message(message: Message):
     get_or_create_user(message.from_user.id, message.from_user.username or "",
                        message.from_user.full_name or "")
     increment_user_messages(message.from_user.id)
+    record_message(chat_id)
 
     # Записываем ВСЕ сообщения в админ-панель
     add_admin_message("user", chat_id, user_name, text)
@@ -633,16 +999,19 @@ async def on_message(message: Message):
             template = random.choice(BOT_KTO_TEMPLATES_2)
             answer = template.format(name1=chosen[0], name2=chosen[1], word=word)
             add_admin_message("bot", chat_id, "NeuroDeep", answer)
+            record_trigger(chat_id, "kto")
             return await message.reply(answer)
         elif len(members) >= 1:
             chosen = random.choice(members)
             template = random.choice(BOT_KTO_TEMPLATES_1)
             answer = template.format(word=word, name=chosen)
             add_admin_message("bot", chat_id, "NeuroDeep", answer)
+            record_trigger(chat_id, "kto")
             return await message.reply(answer)
 
     # 1. Прямое обращение к боту
     if is_direct_to_bot(message):
+        record_trigger(chat_id, "direct")
         response = await ask_neurodeep(chat_id, text, user_name)
         await message.reply(response)
         reset_chat_counter(chat_id)
@@ -651,12 +1020,14 @@ async def on_message(message: Message):
     # 2. Пасхалки
     easter = check_easter_eggs(text)
     if easter:
+        record_trigger(chat_id, "easter")
         add_admin_message("bot", chat_id, "NeuroDeep", easter)
         await message.reply(easter)
         return
 
     # 3. Юмор
     if check_humor_markers(text):
+        record_trigger(chat_id, "humor")
         response = await ask_neurodeep(chat_id, text, user_name)
         await message.reply(response)
         reset_chat_counter(chat_id)
@@ -666,6 +1037,7 @@ async def on_message(message: Message):
     count, trigger = get_chat_counter(chat_id)
     increment_chat_counter(chat_id)
     if count + 1 >= trigger:
+        record_trigger(chat_id, "counter")
         response = await ask_neurodeep(chat_id, text, user_name)
         await message.reply(response)
         reset_chat_counter(chat_id)
@@ -674,7 +1046,8 @@ async def on_message(message: Message):
 #  Запуск
 # ─────────────────────────────────────────────
 async def main():
-    global BOT_INFO
+    global BOT_INFO, BOT_LOOP
+    BOT_LOOP = asyncio.get_running_loop()
     init_db()
     Thread(target=run_keepalive, daemon=True).start()
     BOT_INFO = await bot.get_me()
@@ -686,7 +1059,12 @@ async def main():
         logger.warning(f"Qurox API: {type(e).__name__}: {e}")
     await bot.delete_webhook(drop_pending_updates=True)
     logger.info("NeuroDeep активен! 🧠🔥")
-    await dp.start_polling(bot)
+    stats_task = asyncio.create_task(stats_flush_loop())
+    try:
+        await dp.start_polling(bot)
+    finally:
+        stats_task.cancel()
+        await flush_stats()
 
 if __name__ == "__main__":
     asyncio.run(main())